@@ -1,22 +1,50 @@
 import streamlit as st
 import os
-from PIL import Image
-import base64
+import hashlib
 import json
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL.FontFile import WIDTH
 from dotenv import load_dotenv
 
-from llm_services import LLMServices
-from ocr_services import OCRServices
+from llm_services import COMPARISON_MODELS, LLMServices
+from ocr_services import OCRError, OCRServices, PartialOCRResult
 
-# Load environment variables
-load_dotenv()
+# Load environment variables once per server process rather than on every rerun
+@st.cache_resource(show_spinner=False)
+def load_environment():
+    return load_dotenv()
+
+
+load_environment()
 
 st.set_page_config(layout="wide", page_title="Document Viewer & OCR Tester")
 
 WIDTH = 500
 
+# Folder Streamlit serves at app/static/ (enabled in .streamlit/config.toml)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# Map each OCR service name to the function that runs it
+OCR_SERVICE_FUNCTIONS = {
+    "AWS Textract": OCRServices.aws_textract_ocr,
+    "Landing AI": OCRServices.landing_ai_ocr,
+    "Mistral OCR": OCRServices.mistral_ocr,
+    "Claude 3 Haiku": OCRServices.claude_haiku_ocr,
+}
+
+# Upper bound on OCR API calls in flight across all sessions
+MAX_CONCURRENT_OCR_CALLS = 8
+
+# Published PDFs not viewed for this long are removed from the static folder on startup (seconds)
+STATIC_MAX_AGE = 7 * 24 * 60 * 60
+
+# Bytes sampled from each end of a file when fingerprinting it
+FILE_HASH_SAMPLE_SIZE = 64 * 1024
+
 # Initialize session state variables if they don't exist
 if 'ocr_results' not in st.session_state:
     st.session_state.ocr_results = {}
@@ -28,22 +56,78 @@ if 'processed' not in st.session_state:
     st.session_state.processed = False
 
 # Function to list files in the specified directory
+@st.cache_data(ttl=10)
 def list_files(directory):
     if not os.path.exists(directory):
         st.error(f"Directory '{directory}' does not exist. Please create it and add your files.")
         return []
 
-    files = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
+    # scandir reports the entry type from the directory read, avoiding a stat per file
+    with os.scandir(directory) as entries:
+        files = [entry.name for entry in entries if entry.is_file()]
     return files
 
 
+# Function to fingerprint a file from its size and the bytes at either end
+def get_file_hash(file_path):
+    size = os.path.getsize(file_path)
+    hasher = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, "rb") as f:
+        hasher.update(f.read(FILE_HASH_SAMPLE_SIZE))
+        if size > FILE_HASH_SAMPLE_SIZE:
+            f.seek(max(size - FILE_HASH_SAMPLE_SIZE, FILE_HASH_SAMPLE_SIZE))
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+# Remove interrupted copies and stale PDFs from the static folder, once per server process
+@st.cache_resource(show_spinner=False)
+def prune_static_dir():
+    if not os.path.isdir(STATIC_DIR):
+        return
+    cutoff = time.time() - STATIC_MAX_AGE
+    with os.scandir(STATIC_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp") or entry.stat().st_mtime < cutoff:
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+prune_static_dir()
+
+
+# Function to copy a PDF into Streamlit's static folder once, returning its served URL
+def publish_pdf(pdf_path):
+    file_name = f"{get_file_hash(pdf_path)}.pdf"
+    static_path = os.path.join(STATIC_DIR, file_name)
+    if os.path.exists(static_path):
+        # Mark the copy as recently viewed so pruning keeps it
+        os.utime(static_path)
+    else:
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        # Copy under a temporary name first so concurrent sessions never serve a partial file
+        fd, temp_path = tempfile.mkstemp(dir=STATIC_DIR, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(pdf_path, temp_path)
+            os.replace(temp_path, static_path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+    return f"app/static/{file_name}"
+
+
 # Function to display PDF
 def display_pdf(pdf_path):
-    with open(pdf_path, "rb") as f:
-        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
+    # Serve the file over HTTP rather than inlining it as a base64 data URI
+    pdf_url = publish_pdf(pdf_path)
 
     # Embed PDF in HTML
-    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="{WIDTH}" height="800" type="application/pdf"></iframe>'
+    pdf_display = f'<iframe src="{pdf_url}" width="{WIDTH}" height="800" type="application/pdf"></iframe>'
 
     # Display the PDF
     st.markdown(pdf_display, unsafe_allow_html=True)
@@ -51,42 +135,71 @@ def display_pdf(pdf_path):
 
 # Function to display image
 def display_image(image_path):
-    image = Image.open(image_path)
-    st.image(image, caption=os.path.basename(image_path), width=WIDTH)
+    # Pass the path so Streamlit serves the original bytes without a PIL decode/re-encode
+    st.image(image_path, caption=os.path.basename(image_path), width=WIDTH)
+
+
+# Map each previewable file extension to its display function
+DISPLAY_FUNCTIONS = {
+    ".pdf": display_pdf,
+    ".jpg": display_image,
+    ".jpeg": display_image,
+    ".png": display_image,
+}
+
+
+# Shared thread pool for OCR API calls, created once per server process
+@st.cache_resource
+def get_ocr_executor():
+    return ThreadPoolExecutor(max_workers=MAX_CONCURRENT_OCR_CALLS, thread_name_prefix="ocr")
+
+
+# Raised for a failed or partial OCR result, since st.cache_data never caches exceptions
+class UncachedOCRResult(Exception):
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
+
+# Function to run one OCR service, cached per file content and service; failed and partial
+# results are retried on the next run
+@st.cache_data(show_spinner=False, max_entries=256)
+def run_ocr_service(file_hash, service, file_path):
+    result = OCR_SERVICE_FUNCTIONS[service](file_path)
+    if isinstance(result, (OCRError, PartialOCRResult)):
+        raise UncachedOCRResult(result)
+    return result
 
 
 # Function to process document with OCR services
 def process_document(file_path, ocr_services):
     results = {}
 
+    # Dispatch every selected service up front so the network calls overlap
+    executor = get_ocr_executor()
+    file_hash = get_file_hash(file_path)
+    futures = {
+        service: executor.submit(run_ocr_service, file_hash, service, file_path)
+        for service in ocr_services
+    }
+
     # Create tabs for each OCR service
     ocr_tabs = st.tabs(ocr_services)
 
+    # Render results in the original tab order as each call completes
     for i, service in enumerate(ocr_services):
         with ocr_tabs[i]:
-            if service == "AWS Textract":
-                with st.spinner("Processing with AWS Textract..."):
-                    result = OCRServices.aws_textract_ocr(file_path)
-                    results["AWS Textract"] = result
-                    st.text_area("AWS Textract Result", result, height=400)
-
-            elif service == "Landing AI":
-                with st.spinner("Processing with Landing AI..."):
-                    result = OCRServices.landing_ai_ocr(file_path)
-                    results["Landing AI"] = result
-                    st.text_area("Landing AI Result", result, height=400)
-
-            elif service == "Mistral OCR":
-                with st.spinner("Processing with Mistral OCR..."):
-                    result = OCRServices.mistral_ocr(file_path)
-                    results["Mistral OCR"] = result
-                    st.text_area("Mistral OCR Result", result, height=400)
-
-            elif service == "Claude 3 Haiku":
-                with st.spinner("Processing with Claude 3 Haiku..."):
-                    result = OCRServices.claude_haiku_ocr(file_path)
-                    results["Claude 3 Haiku"] = result
-                    st.text_area("Claude 3 Haiku Result", result, height=400)
+            with st.spinner(f"Processing with {service}..."):
+                try:
+                    result = futures[service].result()
+                except UncachedOCRResult as e:
+                    result = e.result
+                    if isinstance(result, OCRError):
+                        st.error(f"{service} failed and will be retried on the next run.")
+                    else:
+                        st.warning(f"{service} returned partial results and will be retried on the next run.")
+                results[service] = result
+                st.text_area(f"{service} Result", result, height=400)
 
     # Store results in session state for later comparison
     st.session_state.ocr_results = results
@@ -95,15 +208,74 @@ def process_document(file_path, ocr_services):
     return results
 
 
-# Function to compare OCR results using LLM
+# Function to get the LLM comparison prompt, rebuilt only when the OCR results change
+def get_comparison_prompt(results):
+    prompt_key = hash(tuple(results.items()))
+    if st.session_state.get('comparison_prompt_key') != prompt_key:
+        st.session_state.comparison_prompt = LLMServices.build_comparison_prompt(results)
+        st.session_state.comparison_prompt_key = prompt_key
+    return st.session_state.comparison_prompt
+
+
+# Function to compare OCR results using LLM, rendering the analysis as it streams in
 def compare_results(results, model_choice):
-    with st.spinner(f"Analyzing OCR results with {model_choice}..."):
-        comparison = LLMServices.compare_ocr_results(results, model_choice)
+    user_prompt = get_comparison_prompt(results)
+    comparison = st.write_stream(LLMServices.stream_ocr_comparison(results, model_choice, user_prompt))
+    st.session_state.comparison_result = comparison
+    st.session_state.comparison_model = model_choice
+    return comparison
+
+
+# Function to compare OCR results with every available LLM concurrently
+def compare_results_with_all_models(results):
+    with st.spinner(f"Analyzing OCR results with {' and '.join(COMPARISON_MODELS)}..."):
+        user_prompt = get_comparison_prompt(results)
+        comparisons = LLMServices.compare_ocr_results_with_models(results, COMPARISON_MODELS, user_prompt)
+        comparison = "\n\n".join(
+            f"## {model_choice}\n\n{analysis}" for model_choice, analysis in comparisons.items()
+        )
         st.session_state.comparison_result = comparison
-        st.session_state.comparison_model = model_choice
+        st.session_state.comparison_model = ", ".join(comparisons.keys())
         return comparison
 
 
+# Fragment showing stored OCR results, so its text areas don't rerun the whole app
+@st.fragment
+def render_ocr_results(results):
+    ocr_tabs = st.tabs(list(results.keys()))
+    for i, (service, result) in enumerate(results.items()):
+        with ocr_tabs[i]:
+            st.text_area(f"{service} Result", result, height=400)
+
+
+# Fragment for the LLM comparison, so comparing doesn't re-render the OCR tabs
+@st.fragment
+def render_comparison_section():
+    st.subheader("LLM Comparison")
+
+    # Model selection dropdown
+    model_choice = st.selectbox(
+        "Select LLM model for comparison:",
+        COMPARISON_MODELS,
+        index=0
+    )
+
+    # Compare buttons
+    compare_button = st.button("Compare Results with LLM")
+    compare_all_button = st.button("Compare with Both Models")
+
+    if compare_button:
+        compare_results(st.session_state.ocr_results, model_choice)
+    elif compare_all_button:
+        comparison = compare_results_with_all_models(st.session_state.ocr_results)
+        st.markdown(comparison)
+    elif st.session_state.comparison_result:
+        # Display previous comparison result if available
+        if 'comparison_model' in st.session_state:
+            st.write(f"Analysis by: {st.session_state.comparison_model}")
+        st.markdown(st.session_state.comparison_result)
+
+
 # Main app
 def main():
     # Directory path
@@ -128,16 +300,17 @@ def main():
 
         # Display original document
         st.subheader("Original Document")
-        if file_extension == ".pdf":
-            display_pdf(file_path)
-        elif file_extension in [".jpg", ".jpeg", ".png"]:
-            display_image(file_path)
+        display_function = DISPLAY_FUNCTIONS.get(file_extension)
+        if display_function:
+            display_function(file_path)
+        else:
+            st.warning(f"Preview is not supported for {file_extension or 'files without an extension'}.")
 
         # OCR service selection
         st.subheader("Select OCR Services to Test")
         ocr_services = st.multiselect(
             "Choose one or more OCR services:",
-            ["AWS Textract", "Landing AI", "Mistral OCR", "Claude 3 Haiku"],
+            list(OCR_SERVICE_FUNCTIONS.keys()),
             default=["AWS Textract"]
         )
 
@@ -155,33 +328,11 @@ def main():
             elif st.session_state.processed:
                 st.subheader("OCR Results")
                 # Display previously processed results
-                ocr_tabs = st.tabs(list(st.session_state.ocr_results.keys()))
-                for i, (service, result) in enumerate(st.session_state.ocr_results.items()):
-                    with ocr_tabs[i]:
-                        st.text_area(f"{service} Result", result, height=400)
+                render_ocr_results(st.session_state.ocr_results)
 
             # Add LLM comparison section if we have results
             if st.session_state.processed and len(st.session_state.ocr_results) > 1:
-                st.subheader("LLM Comparison")
-
-                # Model selection dropdown
-                model_choice = st.selectbox(
-                    "Select LLM model for comparison:",
-                    ["OpenAI GPT-4o", "Claude Sonnet 3.5"],
-                    index=0
-                )
-
-                # Compare button
-                compare_button = st.button("Compare Results with LLM")
-
-                if compare_button:
-                    comparison = compare_results(st.session_state.ocr_results, model_choice)
-                    st.markdown(comparison)
-                elif st.session_state.comparison_result:
-                    # Display previous comparison result if available
-                    if 'comparison_model' in st.session_state:
-                        st.write(f"Analysis by: {st.session_state.comparison_model}")
-                    st.markdown(st.session_state.comparison_result)
+                render_comparison_section()
             elif st.session_state.processed and len(st.session_state.ocr_results) <= 1:
                 st.info("Select at least two OCR services to enable comparison.")
         else:
@@ -1,5 +1,8 @@
 import os
 import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import requests
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
@@ -9,100 +12,263 @@ from langchain.schema import HumanMessage, SystemMessage
 # Load environment variables
 load_dotenv()
 
+# Retries on rate limits and transient errors, with the client's exponential backoff
+LLM_MAX_RETRIES = 3
+
+# System prompt shared by every comparison request
+SYSTEM_PROMPT = """You are an expert in OCR technology evaluation.
+You will be given OCR results from different services for the same document.
+Your task is to compare these results and determine which service performed best.
+Provide a detailed analysis of the strengths and weaknesses of each OCR service.
+Format your response in markdown."""
+
+# User prompt for a comparison, filled with the results summary and the labeled results
+USER_PROMPT_TEMPLATE = """Compare the following OCR services based on their results:
+
+{summary}
+
+Below are the detailed OCR results from each service. Each service's results are clearly labeled.
+
+{formatted_results}
+
+Please provide a comprehensive analysis of which OCR service performed best and why.
+Consider factors such as:
+1. Text accuracy and correctness
+2. Formatting preservation
+3. Handling of special characters and symbols
+4. Recognition of tables and structured data
+5. Overall completeness of the extracted text
+6. Handling of multi-page documents (if applicable)
+
+For each service, identify specific strengths and weaknesses with examples from the results.
+Conclude with a recommendation of which service would be best for this type of document."""
+
+# Separator placed between each service's results in the comparison prompt
+RESULT_SEPARATOR = "\n\n" + "-" * 50 + "\n\n"
+
+# LLM models offered for comparison
+COMPARISON_MODELS = ["OpenAI GPT-4o", "Claude Sonnet 3.5"]
+
+
+@lru_cache(maxsize=None)
+def _get_llm(model_choice, api_key):
+    """
+    Build the chat client for a model once and reuse it, keeping its HTTP connection pool warm
+
+    Args:
+        model_choice (str): The LLM model to use for comparison
+        api_key (str): API key for the model's provider
+
+    Returns:
+        BaseChatModel: The configured LangChain chat client
+    """
+    if model_choice == "OpenAI GPT-4o":
+        return ChatOpenAI(
+            model="gpt-4o",
+            temperature=0.7,
+            api_key=api_key,
+            max_tokens=4000,  # Set a reasonable limit for the response
+            max_retries=LLM_MAX_RETRIES
+        )
+
+    return ChatAnthropic(
+        model="claude-3-sonnet-20240229",
+        temperature=0.7,
+        api_key=api_key,
+        max_tokens=4000,  # Set a reasonable limit for the response
+        max_retries=LLM_MAX_RETRIES
+    )
+
 
 class LLMServices:
     @staticmethod
-    def compare_ocr_results(results, model_choice="OpenAI GPT-4o"):
+    def compare_ocr_results(results, model_choice="OpenAI GPT-4o", user_prompt=None):
         """
         Compare OCR results using the selected LLM model
 
         Args:
             results (dict): Dictionary containing OCR results from different services
             model_choice (str): The LLM model to use for comparison
+            user_prompt (str, optional): Prompt previously built from these results with
+                build_comparison_prompt; built on demand if omitted
 
         Returns:
             str: Analysis and comparison of the OCR results
         """
         try:
-            # Create a formatted string with clearly labeled results for each service
-            formatted_results = ""
-            for service_name, result in results.items():
-                formatted_results += f"\n\n### {service_name} Results ###\n\n"
-                formatted_results += result
-                formatted_results += "\n\n" + "-"*50 + "\n\n"  # Add a separator between services
-            
-            # Create a summary of the OCR results for the prompt
-            summary = "OCR Results Summary:\n"
-            for service_name in results.keys():
-                summary += f"- {service_name}: {len(results[service_name])} characters\n"
-            
-            # Prepare the system prompt
-            system_prompt = """You are an expert in OCR technology evaluation. 
-            You will be given OCR results from different services for the same document.
-            Your task is to compare these results and determine which service performed best.
-            Provide a detailed analysis of the strengths and weaknesses of each OCR service.
-            Format your response in markdown."""
-            
-            # Prepare the user prompt with the clearly labeled results
-            user_prompt = f"""
-            Compare the following OCR services based on their results:
-            
-            {summary}
-            
-            Below are the detailed OCR results from each service. Each service's results are clearly labeled.
-            
-            {formatted_results}
-            
-            Please provide a comprehensive analysis of which OCR service performed best and why.
-            Consider factors such as:
-            1. Text accuracy and correctness
-            2. Formatting preservation
-            3. Handling of special characters and symbols
-            4. Recognition of tables and structured data
-            5. Overall completeness of the extracted text
-            6. Handling of multi-page documents (if applicable)
-            
-            For each service, identify specific strengths and weaknesses with examples from the results.
-            Conclude with a recommendation of which service would be best for this type of document.
-            """
-            
-            # Initialize the appropriate LLM based on the model choice
-            if model_choice == "OpenAI GPT-4o":
-                api_key = os.getenv('OPENAI_API_KEY')
-                if not api_key:
-                    return "OpenAI API key not configured in .env file"
-                
-                llm = ChatOpenAI(
-                    model="gpt-4o",
-                    temperature=0.7,
-                    api_key=api_key,
-                    max_tokens=4000  # Set a reasonable limit for the response
-                )
-            elif model_choice == "Claude Sonnet 3.5":
-                api_key = os.getenv('ANTHROPIC_API_KEY')
-                if not api_key:
-                    return "Anthropic API key not configured in .env file"
-                
-                llm = ChatAnthropic(
-                    model="claude-3-sonnet-20240229",
-                    temperature=0.7,
-                    api_key=api_key,
-                    max_tokens=4000  # Set a reasonable limit for the response
-                )
-            else:
-                return f"Unsupported model choice: {model_choice}"
-            
-            # Create the messages
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-            ]
+            # Build the prompt unless the caller already has it
+            if user_prompt is None:
+                user_prompt = LLMServices.build_comparison_prompt(results)
+
+            # Reuse the cached client for this model
+            llm, error = LLMServices._get_comparison_llm(model_choice)
+            if error:
+                return error
             
             # Get the response
-            response = llm.invoke(messages)
+            response = llm.invoke(LLMServices._build_messages(user_prompt))
             
             # Return the response content
             return response.content
 
         except Exception as e:
             return f"Error comparing OCR results with {model_choice}: {str(e)}"
+
+    @staticmethod
+    def stream_ocr_comparison(results, model_choice="OpenAI GPT-4o", user_prompt=None):
+        """
+        Compare OCR results using the selected LLM model, yielding the analysis as it is generated
+
+        Args:
+            results (dict): Dictionary containing OCR results from different services
+            model_choice (str): The LLM model to use for comparison
+            user_prompt (str, optional): Prompt previously built from these results with
+                build_comparison_prompt; built on demand if omitted
+
+        Yields:
+            str: Successive pieces of the analysis, or a single error message
+        """
+        try:
+            # Build the prompt unless the caller already has it
+            if user_prompt is None:
+                user_prompt = LLMServices.build_comparison_prompt(results)
+
+            # Reuse the cached client for this model
+            llm, error = LLMServices._get_comparison_llm(model_choice)
+            if error:
+                yield error
+                return
+
+            # Forward text as soon as each chunk arrives
+            for chunk in llm.stream(LLMServices._build_messages(user_prompt)):
+                text = chunk.text()
+                if text:
+                    yield text
+
+        except Exception as e:
+            yield f"Error comparing OCR results with {model_choice}: {str(e)}"
+
+    @staticmethod
+    def _get_comparison_llm(model_choice):
+        """
+        Look up the API key for a comparison model and return its cached chat client
+
+        Args:
+            model_choice (str): The LLM model to use for comparison
+
+        Returns:
+            tuple: (chat client, None) on success, or (None, error message) if the model can't be used
+        """
+        if model_choice == "OpenAI GPT-4o":
+            api_key = os.getenv('OPENAI_API_KEY')
+            if not api_key:
+                return None, "OpenAI API key not configured in .env file"
+        elif model_choice == "Claude Sonnet 3.5":
+            api_key = os.getenv('ANTHROPIC_API_KEY')
+            if not api_key:
+                return None, "Anthropic API key not configured in .env file"
+        else:
+            return None, f"Unsupported model choice: {model_choice}"
+
+        return _get_llm(model_choice, api_key), None
+
+    @staticmethod
+    def _build_messages(user_prompt):
+        """
+        Wrap a comparison prompt in the chat messages sent to the LLM
+
+        Args:
+            user_prompt (str): The prompt built by build_comparison_prompt
+
+        Returns:
+            list: The system and user messages
+        """
+        return [
+            SystemMessage(content=SYSTEM_PROMPT),
+            HumanMessage(content=user_prompt)
+        ]
+
+    @staticmethod
+    def build_comparison_prompt(results):
+        """
+        Build the user prompt asking the LLM to compare OCR results
+
+        Args:
+            results (dict): Dictionary containing OCR results from different services
+
+        Returns:
+            str: The prompt with a summary and the clearly labeled results for each service
+        """
+        # Send byte-identical results only once
+        unique_results, duplicate_groups = LLMServices._deduplicate_results(results)
+
+        # Create a formatted string with clearly labeled results for each service
+        result_parts = []
+        for service_name, result in unique_results.items():
+            result_parts.append(f"\n\n### {service_name} Results ###\n\n")
+            result_parts.append(result)
+            result_parts.append(RESULT_SEPARATOR)  # Add a separator between services
+        formatted_results = "".join(result_parts)
+        
+        # Create a summary of the OCR results for the prompt
+        summary = "OCR Results Summary:\n" + "".join(
+            f"- {service_name}: {len(result)} characters\n" for service_name, result in results.items()
+        ) + "".join(
+            f"- Identical output from {', '.join(group)} (shown once, under {group[0]})\n"
+            for group in duplicate_groups
+        )
+        
+        # Prepare the user prompt with the clearly labeled results
+        return USER_PROMPT_TEMPLATE.format(summary=summary, formatted_results=formatted_results)
+
+    @staticmethod
+    def _deduplicate_results(results):
+        """
+        Collapse OCR results that are byte-identical so they are only sent to the LLM once
+
+        Args:
+            results (dict): Dictionary containing OCR results from different services
+
+        Returns:
+            tuple: (dict of the first service for each distinct result, list of service-name
+                lists for every group of services that returned identical output)
+        """
+        unique_results = {}
+        services_by_digest = {}
+        for service_name, result in results.items():
+            digest = hashlib.blake2b(result.encode('utf-8'), digest_size=16).digest()
+            if digest in services_by_digest:
+                services_by_digest[digest].append(service_name)
+            else:
+                services_by_digest[digest] = [service_name]
+                unique_results[service_name] = result
+
+        duplicate_groups = [group for group in services_by_digest.values() if len(group) > 1]
+        return unique_results, duplicate_groups
+
+    @staticmethod
+    def compare_ocr_results_with_models(results, model_choices, user_prompt=None):
+        """
+        Compare OCR results with several LLM models at once, running the API calls concurrently
+
+        Args:
+            results (dict): Dictionary containing OCR results from different services
+            model_choices (list): The LLM models to use for comparison
+            user_prompt (str, optional): Prompt previously built from these results with
+                build_comparison_prompt; built on demand if omitted
+
+        Returns:
+            dict: Mapping of each model choice to its analysis, in the order given
+        """
+        # Build the prompt once and share it between the models
+        if user_prompt is None:
+            user_prompt = LLMServices.build_comparison_prompt(results)
+
+        with ThreadPoolExecutor(max_workers=len(model_choices)) as executor:
+            futures = {
+                model_choice: executor.submit(
+                    LLMServices.compare_ocr_results, results, model_choice, user_prompt
+                )
+                for model_choice in model_choices
+            }
+            return {model_choice: future.result() for model_choice, future in futures.items()}
@@ -1,22 +1,202 @@
 import os
-import boto3
-import requests
+import io
+import logging
 import json
 import base64
+import mmap
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+import orjson
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Maximum number of PDF pages sent to AWS Textract at the same time (its synchronous TPS limit)
+TEXTRACT_MAX_WORKERS = 8
+
+# PDFs with more pages than this use an asynchronous Textract job when AWS_TEXTRACT_STAGING_BUCKET is set
+TEXTRACT_ASYNC_PAGE_THRESHOLD = 5
+
+# Longest wait between status checks, and overall limit, for asynchronous Textract jobs (seconds)
+TEXTRACT_ASYNC_MAX_POLL_INTERVAL = 30
+TEXTRACT_ASYNC_TIMEOUT = 900
+
+# Maximum number of threads used to rasterize and encode PDF pages
+PDF_MAX_WORKERS = 8
+
+# (connect, read) timeouts in seconds for Landing AI, whose analysis can take minutes
+LANDING_AI_TIMEOUT = (10, 300)
+
+# (connect, read) timeouts in seconds for Mistral's file and OCR endpoints
+MISTRAL_TIMEOUT = (10, 300)
+
+# (connect, read) timeouts in seconds for Anthropic's messages endpoint
+CLAUDE_TIMEOUT = (10, 300)
+
+# Mistral API endpoints for file uploads and OCR
+MISTRAL_FILES_URL = "https://api.mistral.ai/v1/files"
+MISTRAL_OCR_URL = "https://api.mistral.ai/v1/ocr"
+
+# Marker replaced with raw base64 bytes when building JSON request bodies
+BASE64_PLACEHOLDER = "__BASE64_DATA__"
+
+# Fields stripped from AWS Textract responses (expanded list to catch variations)
+TEXTRACT_FIELDS_TO_REMOVE = frozenset({
+    'Geometry', 'BoundingBox', 'Polygon', 'Relationships',
+    'RowIndex', 'ColumnIndex', 'RowSpan', 'ColumnSpan',
+    'CellGeometry', 'TableGeometry', 'TableBoundingBox', 'TablePolygon'
+})
+
+# Magic bytes identifying each supported file type
+FILE_SIGNATURES = {
+    '.pdf': b'%PDF',
+    '.png': b'\x89PNG',
+    '.jpg': b'\xff\xd8\xff',
+    '.jpeg': b'\xff\xd8\xff',
+}
+
+# Largest files each OCR service accepts, checked before any upload (bytes)
+# Textract's synchronous AnalyzeExpense caps images at 10 MB; PDFs are rasterized per page or
+# staged in S3 for an asynchronous job, which accepts up to 500 MB
+TEXTRACT_MAX_IMAGE_SIZE = 10 * 2**20
+TEXTRACT_MAX_PDF_SIZE = 500 * 2**20
+
+# Mistral's file upload limit, also applied to inline images
+MISTRAL_MAX_FILE_SIZE = 50 * 2**20
+
+# Anthropic accepts images up to 5 MB, and request bodies up to 32 MB after base64 inflation
+CLAUDE_MAX_IMAGE_SIZE = 5 * 2**20
+CLAUDE_MAX_PDF_SIZE = 24 * 2**20
+
+
+class OCRError(str):
+    """
+    Error message returned by an OCR service in place of its results
+
+    Subclasses str so callers can keep displaying every result as text, while
+    isinstance() tells failures apart without parsing the message.
+    """
+
+
+class PartialOCRResult(str):
+    """
+    Results from an OCR service that could only process part of the document
+    """
+
+
+# Per-thread scratch buffer for encoding PDF pages, reused across pages handled by the same worker
+_page_buffers = threading.local()
+
+
+def _dumps_json(obj, indent=False):
+    """
+    Serialize an object to JSON with orjson, which is several times faster than json for large OCR responses
+
+    Args:
+        obj: JSON-serializable object
+        indent (bool): Pretty-print with two-space indentation
+
+    Returns:
+        bytes: UTF-8 encoded JSON
+    """
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+
+
+def _loads_json(data):
+    """
+    Parse JSON from a response body with orjson
+
+    Args:
+        data (bytes): UTF-8 encoded JSON
+
+    Returns:
+        The parsed object
+    """
+    return orjson.loads(data)
+
+
+@lru_cache(maxsize=1)
+def _ensure_env():
+    """
+    Load environment variables from .env the first time an OCR service needs them
+    """
+    load_dotenv()
+
+
+@lru_cache(maxsize=1)
+def _get_textract_client():
+    """
+    Create the AWS Textract client once, with credentials from environment variables
+
+    Returns:
+        botocore.client.Textract: Shared client, safe to use from multiple threads
+    """
+    # Imported here so only Textract users pay boto3's import cost
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        'textract',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        region_name=os.getenv('AWS_REGION', 'eu-west-1'),
+        # Retry throttling in-band with client-side rate limiting, and keep a connection per page worker
+        config=Config(
+            retries={'max_attempts': 10, 'mode': 'adaptive'},
+            max_pool_connections=TEXTRACT_MAX_WORKERS * 2
+        )
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_s3_client():
+    """
+    Create the S3 client used to stage PDFs for asynchronous AWS Textract jobs
+
+    Returns:
+        botocore.client.S3: Shared client, safe to use from multiple threads
+    """
+    import boto3
+
+    return boto3.client(
+        's3',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        region_name=os.getenv('AWS_REGION', 'eu-west-1')
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_http_session():
+    """
+    Create the HTTP session shared by the REST-based OCR services
+
+    Returns:
+        requests.Session: Session whose connection pool keeps TCP/TLS connections alive between calls
+    """
+    import requests
+
+    return requests.Session()
 
 
 class OCRServices:
     @staticmethod
-    def convert_pdf_to_image_bytes(file_path):
+    def convert_pdf_to_image_bytes(file_path, fmt='JPEG', dpi=200, max_long_edge=2400):
         """
         Convert a PDF file to a list of image bytes ready for OCR processing
 
         Args:
             file_path (str): Path to the PDF file
+            fmt (str): Image format for each page; 'JPEG' keeps payloads small, 'PNG' is
+                lossless for line-art documents
+            dpi (int): Rasterization resolution
+            max_long_edge (int): Pages whose longer side exceeds this many pixels are
+                downsampled to fit; None disables the cap
 
         Returns:
             list: List of tuples (page_number, image_bytes) for each page of the PDF
@@ -24,22 +204,30 @@ class OCRServices:
         """
         try:
             from pdf2image import convert_from_path
-            import io
 
-            # Convert PDF to images
-            images = convert_from_path(file_path)
+            with tempfile.TemporaryDirectory() as output_folder:
+                # Have Poppler write each page straight to an encoded file at a fixed, OCR-friendly
+                # resolution, one thread per core, so Pillow doesn't have to re-encode it
+                page_paths = convert_from_path(
+                    file_path,
+                    dpi=dpi,
+                    fmt=fmt.lower(),
+                    jpegopt={"quality": 85, "optimize": True, "progressive": False},
+                    output_folder=output_folder,
+                    paths_only=True,
+                    use_pdftocairo=True,
+                    thread_count=min(PDF_MAX_WORKERS, os.cpu_count() or 1)
+                )
 
-            if not images:
-                return None
+                if not page_paths:
+                    return None
 
-            # Convert each image to bytes
-            image_bytes_list = []
-            for page_num, image in enumerate(images):
-                # Convert PIL Image to bytes
-                img_byte_arr = io.BytesIO()
-                image.save(img_byte_arr, format='PNG')
-                image_bytes = img_byte_arr.getvalue()
-                image_bytes_list.append((page_num + 1, image_bytes))
+                # Load each page's bytes in parallel, downsampling oversized pages
+                with ThreadPoolExecutor(max_workers=min(PDF_MAX_WORKERS, len(page_paths))) as executor:
+                    image_bytes_list = list(executor.map(
+                        lambda page: OCRServices._read_page_image(page, fmt, max_long_edge),
+                        enumerate(page_paths, start=1)
+                    ))
 
             return image_bytes_list
 
@@ -48,6 +236,90 @@ class OCRServices:
         except Exception as e:
             raise Exception(f"Error converting PDF to images: {str(e)}")
 
+    @staticmethod
+    def _read_page_image(page, fmt, max_long_edge):
+        """
+        Read a rasterized PDF page from disk, downsampling and re-encoding it only if it is oversized
+
+        Args:
+            page (tuple): (page_number, path to the page image written by Poppler)
+            fmt (str): Image format the page was written in
+            max_long_edge (int): Longest allowed side in pixels, or None for no cap
+
+        Returns:
+            tuple: (page_number, image_bytes)
+        """
+        from PIL import Image
+
+        page_num, page_path = page
+
+        # Opening only reads the header, so checking the size is cheap
+        with Image.open(page_path) as image:
+            if not max_long_edge or max(image.size) <= max_long_edge:
+                with open(page_path, 'rb') as page_file:
+                    return page_num, page_file.read()
+
+            # Downsample oversized pages; OCR accuracy doesn't improve past this size
+            image.thumbnail((max_long_edge, max_long_edge), Image.Resampling.LANCZOS)
+
+            # Convert PIL Image to bytes, reusing this worker thread's buffer between pages
+            img_byte_arr = getattr(_page_buffers, 'buffer', None)
+            if img_byte_arr is None:
+                img_byte_arr = _page_buffers.buffer = io.BytesIO()
+            img_byte_arr.seek(0)
+            img_byte_arr.truncate()
+
+            if fmt == 'JPEG':
+                image.save(img_byte_arr, format='JPEG', quality=85, optimize=True)
+            else:
+                image.save(img_byte_arr, format=fmt)
+            return page_num, img_byte_arr.getvalue()
+
+    @staticmethod
+    def _validate_file(file_path, max_image_size=None, max_pdf_size=None):
+        """
+        Cheaply check that a file exists, is within size limits, and really is a supported type
+
+        Args:
+            file_path (str): Path to the document file
+            max_image_size (int, optional): Largest image the service accepts, in bytes
+            max_pdf_size (int, optional): Largest PDF the service accepts, in bytes
+
+        Returns:
+            str: Description of the problem if the file can't be processed
+            None: If the file looks valid
+        """
+        file_extension = os.path.splitext(file_path)[1].lower()
+        if file_extension not in FILE_SIGNATURES:
+            return f"unsupported file type {file_extension or '(none)'}"
+
+        try:
+            file_size = os.path.getsize(file_path)
+        except OSError as e:
+            return f"cannot read file: {str(e)}"
+
+        if file_size == 0:
+            return "file is empty"
+
+        max_file_size = max_pdf_size if file_extension == '.pdf' else max_image_size
+        if max_file_size is not None and file_size > max_file_size:
+            return f"file is {file_size / 2**20:.1f} MB, above the {max_file_size // 2**20} MB limit"
+
+        # Sniff the header so renamed files are caught before they're uploaded
+        with open(file_path, 'rb') as file:
+            header = file.read(1024)
+
+        # PDFs may have leading bytes before the %PDF marker; images must start with their signature
+        if file_extension == '.pdf':
+            is_valid = FILE_SIGNATURES['.pdf'] in header
+        else:
+            is_valid = header.startswith(FILE_SIGNATURES[file_extension])
+
+        if not is_valid:
+            return f"file contents do not match its {file_extension} extension"
+
+        return None
+
     @staticmethod
     def aws_textract_ocr(file_path):
         """
@@ -57,16 +329,21 @@ class OCRServices:
             file_path (str): Path to the document file
 
         Returns:
-            str: Extracted text and structured data from the document
+            str: Extracted text and structured data from the document; a PartialOCRResult if
+                some pages could not be processed, or an OCRError describing the failure
         """
         try:
-            # Initialize AWS client with credentials from environment variables
-            textract_client = boto3.client(
-                'textract',
-                aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-                region_name=os.getenv('AWS_REGION', 'eu-west-1')
+            _ensure_env()
+
+            # Reject unsupported or malformed files before any expensive work
+            validation_error = OCRServices._validate_file(
+                file_path, TEXTRACT_MAX_IMAGE_SIZE, TEXTRACT_MAX_PDF_SIZE
             )
+            if validation_error:
+                return OCRError(f"Unsupported file for AWS Textract: {validation_error}")
+
+            # Reuse the AWS client created from credentials in environment variables
+            textract_client = _get_textract_client()
 
             # Determine file type
             file_extension = os.path.splitext(file_path)[1].lower()
@@ -74,89 +351,89 @@ class OCRServices:
             # For PDFs, we need to convert to images first for analyze_expense
             if file_extension == '.pdf':
                 try:
+                    from pdf2image import pdfinfo_from_path
+
+                    # Long PDFs go to an asynchronous job on the raw file when a staging bucket is set up,
+                    # skipping local rasterization and the per-page round-trips
+                    staging_bucket = os.getenv('AWS_TEXTRACT_STAGING_BUCKET')
+                    if staging_bucket and pdfinfo_from_path(file_path)["Pages"] > TEXTRACT_ASYNC_PAGE_THRESHOLD:
+                        # Report job errors directly; the single-call fallback below rejects multi-page PDFs
+                        try:
+                            expense_documents, failed_pages = OCRServices._analyze_expense_async(
+                                textract_client, file_path, staging_bucket
+                            )
+                        except Exception as job_error:
+                            return OCRError(f"Error processing with AWS Textract (async job): {str(job_error)}")
+
+                        summary_parts = ["AWS Textract Analysis Summary (StartExpenseAnalysis):\n\n"]
+                        if failed_pages is not None:
+                            summary_parts.append(
+                                "WARNING: Partial results; Textract could not process pages "
+                                f"{', '.join(map(str, failed_pages)) or '(not reported)'}\n\n"
+                            )
+                        OCRServices._append_expense_documents(summary_parts, expense_documents)
+                        summary = "".join(summary_parts)
+                        return PartialOCRResult(summary) if failed_pages is not None else summary
+
                     # Convert PDF to image bytes using our helper method
                     image_bytes_list = OCRServices.convert_pdf_to_image_bytes(file_path)
 
                     if not image_bytes_list:
-                        return "Failed to extract images from PDF"
+                        return OCRError("Failed to extract images from PDF")
 
-                    # Process all pages and collect responses
-                    all_responses = []
-
-                    for page_num, image_bytes in image_bytes_list:
-                        # Use analyze_expense on the image bytes
-                        response = textract_client.analyze_expense(
-                            Document={'Bytes': image_bytes}
-                        )
-                        # Clean the response to remove Geometry, BoundingBox, and Polygon fields
-                        cleaned_response = OCRServices._clean_textract_response(response)
-                        all_responses.append((page_num, cleaned_response))
+                    # Process all pages concurrently; each call is network-bound and the client is thread-safe
+                    max_workers = min(TEXTRACT_MAX_WORKERS, len(image_bytes_list))
+                    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                        all_responses = list(executor.map(
+                            lambda page: OCRServices._analyze_expense_page(textract_client, page),
+                            image_bytes_list
+                        ))
 
                     # Format the combined responses - only include the summary, not the full JSON
-                    combined_summary = "AWS Textract Analysis Summary (Multiple Pages):\n\n"
+                    summary_parts = ["AWS Textract Analysis Summary (Multiple Pages):\n\n"]
 
                     for page_num, response in all_responses:
                         # Extract key information based on the API used
                         if 'ExpenseDocuments' in response:
                             # This is an analyze_expense response
-                            combined_summary += f"--- PAGE {page_num} ---\n"
-
-                            for doc_idx, doc in enumerate(response['ExpenseDocuments']):
-                                combined_summary += f"Document {doc_idx + 1}:\n"
-
-                                # Extract summary fields
-                                if 'SummaryFields' in doc:
-                                    combined_summary += "  Summary Fields:\n"
-                                    for field in doc['SummaryFields']:
-                                        field_type = field.get('Type', {}).get('Text', 'Unknown')
-                                        field_value = field.get('ValueDetection', {}).get('Text', 'N/A')
-                                        combined_summary += f"    {field_type}: {field_value}\n"
-
-                                # Extract line item groups
-                                if 'LineItemGroups' in doc:
-                                    for group_idx, group in enumerate(doc['LineItemGroups']):
-                                        combined_summary += f"  Line Item Group {group_idx + 1}:\n"
-                                        if 'LineItems' in group:
-                                            for item_idx, item in enumerate(group['LineItems']):
-                                                combined_summary += f"    Item {item_idx + 1}:\n"
-                                                if 'LineItemExpenseFields' in item:
-                                                    for field in item['LineItemExpenseFields']:
-                                                        field_type = field.get('Type', {}).get('Text', 'Unknown')
-                                                        field_value = field.get('ValueDetection', {}).get('Text', 'N/A')
-                                                        combined_summary += f"      {field_type}: {field_value}\n"
+                            summary_parts.append(f"--- PAGE {page_num} ---\n")
+                            OCRServices._append_expense_documents(summary_parts, response['ExpenseDocuments'])
+                        elif 'Blocks' in response:
+                            # This page fell back to detect_document_text
+                            summary_parts.append(f"--- PAGE {page_num} (DetectDocumentText) ---\n")
+                            summary_parts.extend(
+                                block.get("Text", "") + "\n"
+                                for block in response['Blocks']
+                                if block.get("BlockType") == "LINE"
+                            )
 
                     # Return only the summary, not the full JSON response
-                    return combined_summary
+                    return "".join(summary_parts)
 
                 except ImportError as ie:
-                    return f"PDF processing error: {str(ie)}"
+                    return OCRError(f"PDF processing error: {str(ie)}")
                 except Exception as pdf_error:
                     # Fallback to detect_document_text if conversion fails
-                    with open(file_path, 'rb') as document:
-                        image_bytes = document.read()
+                    image_bytes = Path(file_path).read_bytes()
 
                     response = textract_client.detect_document_text(
                         Document={'Bytes': image_bytes}
                     )
 
-                    # Clean the response to remove Geometry, BoundingBox, and Polygon fields
-                    cleaned_response = OCRServices._clean_textract_response(response)
-
-                    # Extract text from response
-                    summary = "AWS Textract Analysis Summary (DetectDocumentText):\n\n"
-                    extracted_text = ""
-                    for item in cleaned_response.get("Blocks", []):
-                        if item.get("BlockType") == "LINE":
-                            extracted_text += item.get("Text", "") + "\n"
+                    # Extract LINE text in a single pass; only the text is used, so skip cleaning
+                    extracted_text = "".join(
+                        block.get("Text", "") + "\n"
+                        for block in response.get("Blocks", ())
+                        if block.get("BlockType") == "LINE"
+                    )
 
-                    summary += "Extracted Text:\n" + extracted_text
+                    summary = "AWS Textract Analysis Summary (DetectDocumentText):\n\nExtracted Text:\n" + extracted_text
 
                     # Return only the summary, not the full JSON response
                     return summary
             else:
-                # For images, directly read the file
-                with open(file_path, 'rb') as document:
-                    image_bytes = document.read()
+                # For images, directly read the file; boto3 needs the bytes themselves
+                image_bytes = Path(file_path).read_bytes()
 
                 # Use analyze_expense for images
                 response = textract_client.analyze_expense(
@@ -169,88 +446,180 @@ class OCRServices:
                 # Extract key information based on the API used
                 if 'ExpenseDocuments' in cleaned_response:
                     # This is an analyze_expense response
-                    summary = "AWS Textract Analysis Summary (AnalyzeExpense):\n\n"
-
-                    for doc_idx, doc in enumerate(cleaned_response['ExpenseDocuments']):
-                        summary += f"Document {doc_idx + 1}:\n"
-
-                        # Extract summary fields
-                        if 'SummaryFields' in doc:
-                            summary += "  Summary Fields:\n"
-                            for field in doc['SummaryFields']:
-                                field_type = field.get('Type', {}).get('Text', 'Unknown')
-                                field_value = field.get('ValueDetection', {}).get('Text', 'N/A')
-                                summary += f"    {field_type}: {field_value}\n"
-
-                        # Extract line item groups
-                        if 'LineItemGroups' in doc:
-                            for group_idx, group in enumerate(doc['LineItemGroups']):
-                                summary += f"  Line Item Group {group_idx + 1}:\n"
-                                if 'LineItems' in group:
-                                    for item_idx, item in enumerate(group['LineItems']):
-                                        summary += f"    Item {item_idx + 1}:\n"
-                                        if 'LineItemExpenseFields' in item:
-                                            for field in item['LineItemExpenseFields']:
-                                                field_type = field.get('Type', {}).get('Text', 'Unknown')
-                                                field_value = field.get('ValueDetection', {}).get('Text', 'N/A')
-                                                summary += f"      {field_type}: {field_value}\n"
+                    summary_parts = ["AWS Textract Analysis Summary (AnalyzeExpense):\n\n"]
+                    OCRServices._append_expense_documents(summary_parts, cleaned_response['ExpenseDocuments'])
 
                 # Return only the summary, not the full JSON response
-                return summary
+                return "".join(summary_parts)
 
         except Exception as e:
-            return f"Error processing with AWS Textract: {str(e)}"
+            return OCRError(f"Error processing with AWS Textract: {str(e)}")
+
+    @staticmethod
+    def _append_expense_documents(summary_parts, expense_documents):
+        """
+        Append a readable summary of AWS Textract expense documents to a list of summary lines
+
+        Args:
+            summary_parts (list): Lines of the summary being built; extended in place
+            expense_documents (list): The ExpenseDocuments of an analyze_expense response
+        """
+        for doc_idx, doc in enumerate(expense_documents):
+            summary_parts.append(f"Document {doc_idx + 1}:\n")
+
+            # Extract summary fields
+            if 'SummaryFields' in doc:
+                summary_parts.append("  Summary Fields:\n")
+                for field in doc['SummaryFields']:
+                    field_type = field.get('Type', {}).get('Text', 'Unknown')
+                    field_value = field.get('ValueDetection', {}).get('Text', 'N/A')
+                    summary_parts.append(f"    {field_type}: {field_value}\n")
+
+            # Extract line item groups
+            if 'LineItemGroups' in doc:
+                for group_idx, group in enumerate(doc['LineItemGroups']):
+                    summary_parts.append(f"  Line Item Group {group_idx + 1}:\n")
+                    if 'LineItems' in group:
+                        for item_idx, item in enumerate(group['LineItems']):
+                            summary_parts.append(f"    Item {item_idx + 1}:\n")
+                            if 'LineItemExpenseFields' in item:
+                                for field in item['LineItemExpenseFields']:
+                                    field_type = field.get('Type', {}).get('Text', 'Unknown')
+                                    field_value = field.get('ValueDetection', {}).get('Text', 'N/A')
+                                    summary_parts.append(f"      {field_type}: {field_value}\n")
+
+    @staticmethod
+    def _analyze_expense_async(textract_client, file_path, bucket):
+        """
+        Analyze a whole PDF with an asynchronous AWS Textract expense analysis job
+
+        The PDF is staged in S3 for the duration of the job and deleted afterwards.
+
+        Args:
+            textract_client: boto3 Textract client
+            file_path (str): Path to the PDF file
+            bucket (str): S3 bucket used to stage the PDF
+
+        Returns:
+            tuple: (cleaned ExpenseDocuments from every page of the job's results, sorted
+                numbers of the pages Textract couldn't process if the job only partially
+                succeeded, otherwise None)
+        """
+        s3_client = _get_s3_client()
+        key = f"textract-staging/{uuid.uuid4().hex}/{os.path.basename(file_path)}"
+        s3_client.upload_file(file_path, bucket, key)
+
+        try:
+            job_id = textract_client.start_expense_analysis(
+                DocumentLocation={'S3Object': {'Bucket': bucket, 'Name': key}}
+            )['JobId']
+
+            # Poll with exponential backoff until the job finishes
+            delay = 1
+            deadline = time.monotonic() + TEXTRACT_ASYNC_TIMEOUT
+            while True:
+                response = textract_client.get_expense_analysis(JobId=job_id)
+                if response['JobStatus'] != 'IN_PROGRESS':
+                    break
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Textract job {job_id} did not finish within {TEXTRACT_ASYNC_TIMEOUT}s")
+                time.sleep(delay)
+                delay = min(delay * 2, TEXTRACT_ASYNC_MAX_POLL_INTERVAL)
+
+            job_status = response['JobStatus']
+            if job_status not in ('SUCCEEDED', 'PARTIAL_SUCCESS'):
+                raise Exception(f"Textract job {job_id} {job_status}: {response.get('StatusMessage', '')}")
+
+            # Collect every page of results, noting the document pages a partial job skipped
+            expense_documents = []
+            failed_pages = set()
+            while True:
+                for warning in response.get('Warnings', ()):
+                    failed_pages.update(warning.get('Pages', ()))
+                expense_documents.extend(
+                    OCRServices._clean_textract_response(response).get('ExpenseDocuments', [])
+                )
+                next_token = response.get('NextToken')
+                if not next_token:
+                    if job_status == 'PARTIAL_SUCCESS':
+                        return expense_documents, sorted(failed_pages)
+                    return expense_documents, None
+                response = textract_client.get_expense_analysis(JobId=job_id, NextToken=next_token)
+        finally:
+            s3_client.delete_object(Bucket=bucket, Key=key)
+
+    @staticmethod
+    def _analyze_expense_page(textract_client, page):
+        """
+        Run AWS Textract analyze_expense on a single rasterized PDF page
+
+        If analyze_expense fails for the page (after the client's own retries), the page falls
+        back to detect_document_text so one bad page doesn't discard the rest of the document.
+
+        Args:
+            textract_client: boto3 Textract client
+            page (tuple): (page_number, image_bytes) as returned by convert_pdf_to_image_bytes
+
+        Returns:
+            tuple: (page_number, cleaned analyze_expense response, or the raw
+                detect_document_text response if the page fell back)
+        """
+        from botocore.exceptions import ClientError
+
+        page_num, image_bytes = page
+
+        # Use analyze_expense on the image bytes
+        try:
+            response = textract_client.analyze_expense(
+                Document={'Bytes': image_bytes}
+            )
+        except ClientError:
+            return page_num, textract_client.detect_document_text(
+                Document={'Bytes': image_bytes}
+            )
+
+        # Clean the response to remove Geometry, BoundingBox, and Polygon fields
+        return page_num, OCRServices._clean_textract_response(response)
 
     @staticmethod
     def _clean_textract_response(response):
         """
         Remove Geometry, BoundingBox, and Polygon fields from AWS Textract response
 
+        The response is pruned in place; callers must not rely on the original afterwards.
+
         Args:
             response (dict): The original AWS Textract response
 
         Returns:
             dict: The cleaned response with unwanted fields removed
         """
-        # Create a deep copy of the response to avoid modifying the original
-        full_response = json.loads(json.dumps(response))
-
-        # Fields to remove (expanded list to catch variations)
-        fields_to_remove = [
-            'Geometry', 'BoundingBox', 'Polygon', 'Relationships',
-            'RowIndex', 'ColumnIndex', 'RowSpan', 'ColumnSpan',
-            'CellGeometry', 'TableGeometry', 'TableBoundingBox', 'TablePolygon'
-        ]
-
-        # Helper function to recursively remove fields from a dictionary
-        def remove_fields(obj):
+        # Count removed fields for debugging output below
+        removed_count = 0
+
+        # Local aliases avoid repeated global lookups in the loop
+        fields_to_remove = TEXTRACT_FIELDS_TO_REMOVE
+        containers = (dict, list)
+
+        # Walk the response depth-first with an explicit stack, removing fields in place;
+        # this avoids a Python call per node and can't hit the recursion limit
+        stack = [response]
+        while stack:
+            obj = stack.pop()
             if isinstance(obj, dict):
                 # Remove unwanted fields
-                for field in fields_to_remove:
-                    if field in obj:
-                        del obj[field]
-
-                # Process remaining fields recursively
-                for key, value in list(obj.items()):
-                    obj[key] = remove_fields(value)
-                return obj
-            elif isinstance(obj, list):
-                # Process list items recursively
-                return [remove_fields(item) for item in obj]
-            else:
-                # Return primitive values as is
-                return obj
+                for field in fields_to_remove.intersection(obj):
+                    del obj[field]
+                    removed_count += 1
 
-        # Clean the response
-        cleaned = remove_fields(full_response)
+                # Queue nested containers
+                stack.extend(value for value in obj.values() if isinstance(value, containers))
+            else:
+                stack.extend(item for item in obj if isinstance(item, containers))
 
-        # For debugging: print the size reduction
-        original_size = len(json.dumps(response))
-        cleaned_size = len(json.dumps(cleaned))
-        reduction_percent = ((original_size - cleaned_size) / original_size) * 100 if original_size > 0 else 0
-        print(f"AWS Textract response cleaning: Original size: {original_size}, Cleaned size: {cleaned_size}, Reduction: {reduction_percent:.2f}%")
+        logger.debug("AWS Textract response cleaning: removed %d fields", removed_count)
 
-        return cleaned
+        return response
 
     @staticmethod
     def landing_ai_ocr(file_path):
@@ -261,48 +630,48 @@ class OCRServices:
             file_path (str): Path to the document file
 
         Returns:
-            str: Extracted text and analysis from the document
+            str: Extracted text and analysis from the document, or an OCRError describing the failure
         """
         try:
+            _ensure_env()
+
+            # Reject unsupported or malformed files before any expensive work
+            validation_error = OCRServices._validate_file(file_path)
+            if validation_error:
+                return OCRError(f"Unsupported file for Landing AI: {validation_error}")
+
             # Get API credentials from environment variables
             api_key = os.getenv('LANDING_AI_API_KEY')
             api_url = os.getenv('LANDING_AI_ENDPOINT', 'https://api.va.landing.ai/v1/tools/agentic-document-analysis')
 
             if not api_key:
-                return "Landing AI credentials not configured in .env file"
+                return OCRError("Landing AI credentials not configured in .env file")
 
             # Determine file type and prepare request
             file_extension = os.path.splitext(file_path)[1].lower()
 
-            if file_extension in ['.jpg', '.jpeg', '.png']:
-                files = {
-                    "image": open(file_path, "rb")
-                }
-            elif file_extension == '.pdf':
-                files = {
-                    "pdf": open(file_path, "rb")
-                }
-            else:
-                return f"Unsupported file type for Landing AI: {file_extension}"
+            file_field = "pdf" if file_extension == '.pdf' else "image"
 
             # Prepare headers
             headers = {
                 "Authorization": f"Basic {api_key}"
             }
 
-            # Make API request
-            response = requests.post(api_url, files=files, headers=headers)
+            # Make API request, closing the upload handle once it's sent
+            with open(file_path, "rb") as document:
+                files = {file_field: document}
+                response = _get_http_session().post(
+                    api_url, files=files, headers=headers, timeout=LANDING_AI_TIMEOUT
+                )
 
             if response.status_code == 200:
-                result = response.json()
-                # Format the response for display
-                formatted_response = json.dumps(result, indent=2)
-                return formatted_response
+                # The body is already JSON, so return it as-is rather than parsing and re-serializing
+                return response.text
             else:
-                return f"Landing AI API error: {response.status_code} - {response.text}"
+                return OCRError(f"Landing AI API error: {response.status_code} - {response.text}")
 
         except Exception as e:
-            return f"Error processing with Landing AI: {str(e)}"
+            return OCRError(f"Error processing with Landing AI: {str(e)}")
 
     @staticmethod
     def mistral_ocr(file_path):
@@ -313,29 +682,29 @@ class OCRServices:
             file_path (str): Path to the document file
 
         Returns:
-            str: Extracted text and structured data from the document
+            str: Extracted text and structured data from the document, or an OCRError describing the failure
         """
         try:
+            _ensure_env()
+
+            # Reject unsupported or malformed files before any expensive work
+            validation_error = OCRServices._validate_file(
+                file_path, MISTRAL_MAX_FILE_SIZE, MISTRAL_MAX_FILE_SIZE
+            )
+            if validation_error:
+                return OCRError(f"Unsupported file for Mistral OCR: {validation_error}")
+
             # Get API key from environment variables
             api_key = os.getenv('MISTRAL_API_KEY')
 
             if not api_key:
-                return "Mistral OCR credentials not configured in .env file"
+                return OCRError("Mistral OCR credentials not configured in .env file")
 
             # Determine file type
             file_extension = os.path.splitext(file_path)[1].lower()
             file_name = os.path.basename(file_path)
 
-            # Check if file type is supported
-            if file_extension not in ['.pdf', '.jpg', '.jpeg', '.png']:
-                return f"Unsupported file type for Mistral OCR: {file_extension}"
-
-            # For PDFs and images, we'll use base64 encoding
-            with open(file_path, 'rb') as file:
-                file_bytes = file.read()
-
-            # Base64 encode the file
-            encoded_file = base64.b64encode(file_bytes).decode('utf-8')
+            session = _get_http_session()
 
             # Prepare headers for OCR request
             ocr_headers = {
@@ -343,20 +712,51 @@ class OCRServices:
                 'Content-Type': 'application/json'
             }
 
-            # Prepare the OCR payload based on file type
             if file_extension == '.pdf':
+                # Upload the PDF as raw multipart bytes and reference it by id, avoiding base64 entirely
+                with open(file_path, 'rb') as document:
+                    upload_response = session.post(
+                        MISTRAL_FILES_URL,
+                        headers={'Authorization': f'Bearer {api_key}'},
+                        files={'file': (file_name, document, 'application/pdf')},
+                        data={'purpose': 'ocr'},
+                        timeout=MISTRAL_TIMEOUT
+                    )
+
+                if upload_response.status_code != 200:
+                    return OCRError(f"Mistral file upload error: {upload_response.status_code} - {upload_response.text}")
+
+                file_id = _loads_json(upload_response.content)['id']
+
+                # Make the OCR request against the uploaded file, then remove it from Mistral's storage
                 ocr_payload = {
                     "model": "mistral-ocr-latest",
                     "document": {
-                        "type": "document_base64",
-                        "document_base64": encoded_file,
-                        "document_name": file_name
+                        "type": "file",
+                        "file_id": file_id
                     }
                 }
+                try:
+                    ocr_response = session.post(
+                        MISTRAL_OCR_URL, headers=ocr_headers, json=ocr_payload, timeout=MISTRAL_TIMEOUT
+                    )
+                finally:
+                    # A failed cleanup shouldn't discard the OCR result
+                    try:
+                        session.delete(
+                            f"{MISTRAL_FILES_URL}/{file_id}",
+                            headers={'Authorization': f'Bearer {api_key}'},
+                            timeout=MISTRAL_TIMEOUT
+                        )
+                    except Exception as e:
+                        logger.warning("Failed to delete Mistral file %s: %s", file_id, e)
             else:  # Image files
+                # Images are sent inline as base64, kept as bytes
+                encoded_file = OCRServices._base64_encode_file(file_path)
+
                 # Create a data URL for the image
                 mime_type = f"image/{file_extension[1:]}" if file_extension != '.jpg' else "image/jpeg"
-                data_url = f"data:{mime_type};base64,{encoded_file}"
+                data_url = f"data:{mime_type};base64,{BASE64_PLACEHOLDER}"
 
                 ocr_payload = {
                     "model": "mistral-ocr-latest",
@@ -366,47 +766,85 @@ class OCRServices:
                     }
                 }
 
-            # Make the OCR request
-            ocr_url = "https://api.mistral.ai/v1/ocr"
-            ocr_response = requests.post(ocr_url, headers=ocr_headers, json=ocr_payload)
+                # Make the OCR request
+                ocr_body = OCRServices._json_body_with_base64(ocr_payload, encoded_file)
+                ocr_response = session.post(
+                    MISTRAL_OCR_URL, headers=ocr_headers, data=ocr_body, timeout=MISTRAL_TIMEOUT
+                )
 
             # Check if the OCR request was successful
             if ocr_response.status_code != 200:
-                return f"Mistral OCR API error: {ocr_response.status_code} - {ocr_response.text}"
+                return OCRError(f"Mistral OCR API error: {ocr_response.status_code} - {ocr_response.text}")
 
             # Process the OCR response
-            result = ocr_response.json()
+            result = _loads_json(ocr_response.content)
 
             # Format the response for display
-            formatted_response = json.dumps(result, indent=2)
+            formatted_response = _dumps_json(result, indent=True).decode('utf-8')
 
             # Create a summary of the OCR results
-            summary = "Mistral OCR Analysis Summary:\n\n"
+            summary_parts = ["Mistral OCR Analysis Summary:\n\n"]
 
             # Extract text content from the response
             if 'pages' in result:
                 for page in result['pages']:
                     page_num = page.get('index', 0)
-                    summary += f"--- PAGE {page_num} ---\n"
+                    summary_parts.append(f"--- PAGE {page_num} ---\n")
 
                     # Add page dimensions if available
                     if 'dimensions' in page:
                         dimensions = page['dimensions']
-                        summary += f"Dimensions: {dimensions.get('width', 'N/A')}x{dimensions.get('height', 'N/A')} (DPI: {dimensions.get('dpi', 'N/A')})\n"
+                        summary_parts.append(f"Dimensions: {dimensions.get('width', 'N/A')}x{dimensions.get('height', 'N/A')} (DPI: {dimensions.get('dpi', 'N/A')})\n")
 
                     # Add number of images if available
                     if 'images' in page:
-                        summary += f"Images: {len(page['images'])}\n"
+                        summary_parts.append(f"Images: {len(page['images'])}\n")
 
                     # Add markdown content if available
                     if 'markdown' in page:
-                        summary += f"\nText Content:\n{page['markdown']}\n\n"
+                        summary_parts.append(f"\nText Content:\n{page['markdown']}\n\n")
+
+            summary = "".join(summary_parts)
 
             # Return both the summary and the full response
             return f"{summary}\n\nFull Response:\n{formatted_response}"
 
         except Exception as e:
-            return f"Error processing with Mistral OCR: {str(e)}"
+            return OCRError(f"Error processing with Mistral OCR: {str(e)}")
+
+    @staticmethod
+    def _base64_encode_file(file_path):
+        """
+        Base64-encode a file through a read-only memory map, so its contents are never copied
+        into a Python bytes object first
+
+        Args:
+            file_path (str): Path to the file
+
+        Returns:
+            bytes: The base64-encoded file contents
+        """
+        with open(file_path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return base64.b64encode(mapped)
+
+    @staticmethod
+    def _json_body_with_base64(payload, encoded_file):
+        """
+        Serialize a JSON request body, splicing base64 bytes in where BASE64_PLACEHOLDER appears
+
+        This avoids decoding the base64 data to str and having it copied again by the JSON
+        encoder; the base64 alphabet never needs JSON escaping.
+
+        Args:
+            payload (dict): Request payload containing BASE64_PLACEHOLDER exactly once
+            encoded_file (bytes): Base64-encoded file contents
+
+        Returns:
+            bytes: The UTF-8 encoded JSON body
+        """
+        prefix, suffix = json.dumps(payload).split(BASE64_PLACEHOLDER)
+        return b"".join((prefix.encode('utf-8'), encoded_file, suffix.encode('utf-8')))
 
     @staticmethod
     def claude_haiku_ocr(file_path):
@@ -417,28 +855,29 @@ class OCRServices:
             file_path (str): Path to the document file
 
         Returns:
-            str: Extracted text and analysis from the document
+            str: Extracted text and analysis from the document, or an OCRError describing the failure
         """
         try:
+            _ensure_env()
+
+            # Reject unsupported or malformed files before any expensive work
+            validation_error = OCRServices._validate_file(
+                file_path, CLAUDE_MAX_IMAGE_SIZE, CLAUDE_MAX_PDF_SIZE
+            )
+            if validation_error:
+                return OCRError(f"Unsupported file for Claude 3 Haiku OCR: {validation_error}")
+
             # Get API key from environment variables
             api_key = os.getenv('ANTHROPIC_API_KEY')
 
             if not api_key:
-                return "Anthropic API credentials not configured in .env file"
+                return OCRError("Anthropic API credentials not configured in .env file")
 
             # Determine file type
             file_extension = os.path.splitext(file_path)[1].lower()
 
-            # Check if file type is supported
-            if file_extension not in ['.pdf', '.jpg', '.jpeg', '.png']:
-                return f"Unsupported file type for Claude 3 Haiku OCR: {file_extension}"
-
             # For PDFs and images, we'll use base64 encoding
-            with open(file_path, 'rb') as file:
-                file_bytes = file.read()
-
-            # Base64 encode the file
-            encoded_file = base64.b64encode(file_bytes).decode('utf-8')
+            encoded_file = OCRServices._base64_encode_file(file_path).decode('ascii')
 
             # Determine media type based on file extension
             if file_extension == '.pdf':
@@ -484,19 +923,19 @@ class OCRServices:
 
             # Make the API request
             api_url = "https://api.anthropic.com/v1/messages"
-            response = requests.post(api_url, headers=headers, json=payload)
+            response = _get_http_session().post(api_url, headers=headers, json=payload, timeout=CLAUDE_TIMEOUT)
 
             # Check if the request was successful
             if response.status_code != 200:
-                return f"Claude 3 Haiku API error: {response.status_code} - {response.text}"
+                return OCRError(f"Claude 3 Haiku API error: {response.status_code} - {response.text}")
 
             # Process the response
-            result = response.json()
+            result = _loads_json(response.content)
 
             # Extract the content from the response
             if 'content' in result and len(result['content']) > 0:
                 # Format the full response for debugging
-                formatted_full_response = json.dumps(result, indent=2)
+                formatted_full_response = _dumps_json(result, indent=True).decode('utf-8')
 
                 # Extract the text content from the response
                 text_content = ""
@@ -510,7 +949,7 @@ class OCRServices:
                 # Return both the extracted text and the full response
                 return f"{summary}{text_content}\n\nFull API Response:\n{formatted_full_response}"
             else:
-                return "No content returned from Claude 3 Haiku API"
+                return OCRError("No content returned from Claude 3 Haiku API")
 
         except Exception as e:
-            return f"Error processing with Claude 3 Haiku OCR: {str(e)}"
+            return OCRError(f"Error processing with Claude 3 Haiku OCR: {str(e)}")